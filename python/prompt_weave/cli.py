@@ -42,6 +42,11 @@ def main() -> None:
         metavar="NAME",
         help="Ordered list of snippet names to include",
     )
+    regen.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail without writing anything if any snippet is missing",
+    )
 
     args = parser.parse_args()
 
@@ -51,6 +56,7 @@ def main() -> None:
                 workspace=args.workspace,
                 builtin_snippets_dir=args.builtin_snippets,
                 include=args.include,
+                strict=args.strict,
             )
         except Exception as exc:  # noqa: BLE001
             print(f"Error: {exc}", file=sys.stderr)
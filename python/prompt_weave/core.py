@@ -2,20 +2,30 @@
 
 from __future__ import annotations
 
+import contextlib
+import os
+import stat
 import sys
 from pathlib import Path
 from typing import NamedTuple
 from typing import Optional
 
-import frontmatter
-
 # The magic separator — invisible when rendered, machine-readable.
 # Everything above is generated; everything below is user-owned.
 SEPARATOR = "<!-- prompt-weave:generated - do not edit above this line -->"
+_SEPARATOR_BYTES = SEPARATOR.encode("utf-8")
+_SEPARATOR_LINE = _SEPARATOR_BYTES + b"\n"
+
+# #line-style provenance comment emitted above each snippet body.
+_DIRECTIVE_FMT = '<!-- prompt-weave:line %d "%s" -->'
 
 # Fixed user-level snippets directory (no configuration needed).
 USER_SNIPPETS_DIR = Path.home() / ".prompt-weave" / "snippets"
 
+# Workspace-relative locations of workspace snippets and the generated file.
+_WORKSPACE_SNIPPETS_REL = Path(".prompt-weave") / "snippets"
+_OUTPUT_REL = Path(".github") / "copilot-instructions.md"
+
 
 class ResolvedSnippet(NamedTuple):
     """Resolved snippet content and provenance metadata."""
@@ -25,15 +35,96 @@ class ResolvedSnippet(NamedTuple):
     source_line: int
 
 
-def _strip_frontmatter(path: Path) -> str:
-    """Load a Markdown file and return only the content (front matter stripped)."""
-    post = frontmatter.load(str(path))
-    return str(post.content)
+# Parsed snippets keyed by path, validated by (st_mtime_ns, st_size) so a
+# long-lived process only re-reads files that changed.
+_SNIPPET_CACHE: dict[Path, tuple[int, int, ResolvedSnippet]] = {}
+
+
+def clear_snippet_cache() -> None:
+    """Forget every cached snippet so the next load reads from disk."""
+    _SNIPPET_CACHE.clear()
 
 
-def _content_start_line(path: Path) -> int:
-    """Return 1-based line where snippet body starts in a Markdown file."""
-    text = path.read_text(encoding="utf-8")
+def _load_snippet(path: Path) -> ResolvedSnippet:
+    """Read a snippet file once; return its body and where that body starts.
+
+    The body has its front matter stripped; the start line is 1-based. The
+    source label is left empty for the caller, which knows the tier, to
+    fill in. Results are cached until the file's mtime or size changes.
+    """
+    st = path.stat()
+    cached = _SNIPPET_CACHE.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    # Raw fd read sized from the stat above: snippets are small, so skip the
+    # buffered file object. One extra byte shows whether the file has grown.
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            data = os.read(fd, st.st_size + 1)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        # os.read errors carry no filename; attach it so messages name the file.
+        if exc.filename is None:
+            exc.filename = os.fspath(path)
+        raise
+    if len(data) > st.st_size:
+        data = path.read_bytes()
+    snippet = _split_frontmatter(_normalize_newlines(data))
+    _SNIPPET_CACHE[path] = (st.st_mtime_ns, st.st_size, snippet)
+    return snippet
+
+
+def _normalize_newlines(data: bytes) -> bytes:
+    """Turn CRLF and lone CR into LF, as a text-mode read would."""
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data
+
+
+def _split_frontmatter(data: bytes) -> ResolvedSnippet:
+    """Split Markdown *data* into its stripped body and the body's start line.
+
+    The front matter is discarded, so a plain ``---`` fence pair is found by
+    scanning the raw bytes rather than parsing YAML, and the start line is
+    counted from the closing fence's offset. The body is decoded once, so
+    invalid UTF-8 is rejected as a text read would reject it, and stripped as
+    text so Unicode whitespace is trimmed too. Anything else (longer fences,
+    leading blank lines, no closing fence) falls back to python-frontmatter,
+    with the start line found by ``_content_start_line``.
+    """
+    if data.startswith(b"---"):
+        eol = data.find(b"\n")
+        if eol != -1 and not data[3:eol].strip():
+            # Only the first line starting with ``---`` can close the block;
+            # if it is anything but a bare fence (``----``, ``---x``), fall back.
+            fence = data.find(b"\n---", eol)
+            if fence != -1:
+                line_end = data.find(b"\n", fence + 4)
+                if line_end == -1:
+                    line_end = len(data)
+                if not data[fence + 4:line_end].strip():
+                    # Lines before the closing fence, plus the fence itself.
+                    start_line = data.count(b"\n", 0, fence + 1) + 2
+                    body = data[line_end + 1:].decode("utf-8").strip()
+                    return ResolvedSnippet(content=body, source_label="", source_line=start_line)
+
+    raw = data.decode("utf-8")
+    text = raw.strip()
+    if text.startswith("---"):
+        # Imported here: it pulls in PyYAML, which the common path never needs.
+        import frontmatter
+
+        text = str(frontmatter.loads(text).content)
+    return ResolvedSnippet(
+        content=text, source_label="", source_line=_content_start_line(raw)
+    )
+
+
+def _content_start_line(text: str) -> int:
+    """Return 1-based line where snippet body starts in Markdown *text*."""
     lines = text.splitlines()
 
     if lines and lines[0].strip() == "---":
@@ -44,20 +135,23 @@ def _content_start_line(path: Path) -> int:
     return 1
 
 
-def _source_label(
-    directory: Path,
-    candidate: Path,
-    workspace_snippets_dir: Path,
-    builtin_snippets_dir: Path,
-) -> str:
-    """Return stable source label used in generated line directives."""
-    if directory == workspace_snippets_dir:
-        return f"workspace:{candidate.name}"
-    if directory == USER_SNIPPETS_DIR:
-        return f"user:{candidate.name}"
-    if directory == builtin_snippets_dir:
-        return f"builtin:{candidate.name}"
-    return candidate.name
+def _label_prefixes(workspace_snippets_dir: Path, builtin_snippets_dir: Path) -> dict[str, str]:
+    """Map each search directory (as a string) to its source-label prefix."""
+    # Listed lowest priority first so that, if two tiers resolve to the same
+    # directory, the higher-priority label wins.
+    return {
+        str(builtin_snippets_dir): "builtin:",
+        str(USER_SNIPPETS_DIR): "user:",
+        str(workspace_snippets_dir): "workspace:",
+    }
+
+
+def _try_load(directory: Path, name: str) -> Optional[ResolvedSnippet]:
+    """Load snippet *name* from *directory*, or return None if it is not there."""
+    try:
+        return _load_snippet(directory / f"{name}.md")
+    except (FileNotFoundError, NotADirectoryError):
+        return None
 
 
 def resolve_snippet(
@@ -66,20 +160,17 @@ def resolve_snippet(
     workspace_snippets_dir: Path,
     builtin_snippets_dir: Path,
 ) -> Optional[ResolvedSnippet]:
-    """Resolve a snippet and include provenance metadata for generation."""
+    """Resolve a snippet and include provenance metadata for generation.
+
+    Probes *search_dirs* in order; first match wins. Directories outside
+    the three tiers get no label prefix.
+    """
+    label_prefixes = _label_prefixes(workspace_snippets_dir, builtin_snippets_dir)
     for directory in search_dirs:
-        candidate = directory / f"{name}.md"
-        if candidate.exists():
-            return ResolvedSnippet(
-                content=_strip_frontmatter(candidate),
-                source_label=_source_label(
-                    directory=directory,
-                    candidate=candidate,
-                    workspace_snippets_dir=workspace_snippets_dir,
-                    builtin_snippets_dir=builtin_snippets_dir,
-                ),
-                source_line=_content_start_line(candidate),
-            )
+        snippet = _try_load(directory, name)
+        if snippet is not None:
+            label_prefix = label_prefixes.get(str(directory), "")
+            return snippet._replace(source_label=f"{label_prefix}{Path(name).name}.md")
     return None
 
 
@@ -89,17 +180,81 @@ def load_snippet(name: str, search_dirs: list[Path]) -> Optional[str]:
     Searches *search_dirs* in order; first match wins.
     Returns None if the snippet is not found in any directory.
     """
-    for directory in search_dirs:
-        candidate = directory / f"{name}.md"
-        if candidate.exists():
-            return _strip_frontmatter(candidate)
-    return None
+    snippet = next(
+        (found for directory in search_dirs if (found := _try_load(directory, name)) is not None),
+        None,
+    )
+    return None if snippet is None else snippet.content
+
+
+class _ExistingOutput(NamedTuple):
+    """An existing output file, split at the separator (raw UTF-8 bytes)."""
+
+    data: bytes
+    user_section: bytes
+    has_separator: bool
+
+
+def _parse_existing(path: Path) -> _ExistingOutput:
+    """Read *path* once and split off the user-owned section.
+
+    Without a separator the whole file is user content. A missing file
+    reads as empty. The user section gets the same newline normalization
+    and text strip as snippet bodies, so the assembled file never mixes
+    line endings.
+    """
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return _ExistingOutput(data=b"", user_section=b"", has_separator=False)
+
+    _, separator, below = data.partition(_SEPARATOR_BYTES)
+    user_text = _normalize_newlines(below if separator else data).decode("utf-8").strip()
+    return _ExistingOutput(
+        data=data, user_section=user_text.encode("utf-8"), has_separator=bool(separator)
+    )
+
+
+def _write_bytes_atomic(path: Path, data: bytes) -> None:
+    """Write *data* to *path* via a uniquely named temp file and ``os.replace``.
+
+    Readers see either the old file or the new one, never a partial write.
+    A symlinked *path* has its target replaced rather than the link, the
+    file keeps its mode, and the temp file is removed if anything fails.
+    """
+    target = Path(os.path.realpath(path))
+    try:
+        mode: Optional[int] = stat.S_IMODE(os.stat(target).st_mode)
+    except FileNotFoundError:
+        # New file: os.open below applies the process umask to 0o666.
+        mode = None
+
+    # Unique per process and call, so concurrent regenerations never collide.
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    fd = os.open(tmp_path, flags, 0o666)
+    try:
+        # Raw fd I/O: the data is already encoded, so skip the buffered file object.
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, target)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
 
 
 def regenerate(
     workspace: Path,
     builtin_snippets_dir: Path,
     include: list[str],
+    strict: bool = False,
 ) -> list[str]:
     """Assemble and write .github/copilot-instructions.md for *workspace*.
 
@@ -108,77 +263,78 @@ def regenerate(
     3. Append the magic separator.
     4. Preserve any user content that was already below the separator.
     5. Write the result, creating parent directories as needed.
+
+    Missing snippets raise RuntimeError after the found ones are written;
+    with *strict*, they raise before anything is written.
     """
-    workspace_snippets_dir = workspace / ".prompt-weave" / "snippets"
-    output_path = workspace / ".github" / "copilot-instructions.md"
+    workspace_snippets_dir = workspace / _WORKSPACE_SNIPPETS_REL
+    output_path = workspace / _OUTPUT_REL
 
     # --- Extract existing user content below separator --------------------
-    user_section = ""
-    if output_path.exists():
-        existing = output_path.read_text(encoding="utf-8")
-        if SEPARATOR in existing:
-            user_section = existing.split(SEPARATOR, 1)[1].strip()
-        else:
-            # No separator — entire file is user content
-            user_section = existing.strip()
+    existing = _parse_existing(output_path)
 
     # --- Empty include: revert to plain user file -------------------------
     if not include:
-        if output_path.exists() and SEPARATOR in output_path.read_text(encoding="utf-8"):
-            if user_section:
-                output_path.write_text(user_section + "\n", encoding="utf-8")
+        if existing.has_separator:
+            if existing.user_section:
+                _write_bytes_atomic(output_path, existing.user_section + b"\n")
             else:
                 output_path.unlink()
         return []
 
-    # Search order: workspace (highest priority) → user home → built-in
-    search_dirs = [workspace_snippets_dir, USER_SNIPPETS_DIR, builtin_snippets_dir]
-
-    # --- Build generated section ------------------------------------------
-    bodies: list[str] = []
-    included: list[str] = []
-    missing: list[str] = []
-
-    for name in include:
-        resolved = resolve_snippet(
-            name=name,
-            search_dirs=search_dirs,
-            workspace_snippets_dir=workspace_snippets_dir,
-            builtin_snippets_dir=builtin_snippets_dir,
+    # Search order: workspace (highest priority) → user home → built-in.
+    # Absent tiers (often the user and workspace ones) cost one stat here
+    # rather than a failed probe per name.
+    search_dirs = [
+        d
+        for d in (workspace_snippets_dir, USER_SNIPPETS_DIR, builtin_snippets_dir)
+        if d.is_dir()
+    ]
+
+    # --- Resolve snippets -------------------------------------------------
+    # Duplicate names are emitted each time but resolved (and read) only once.
+    resolved_by_name = {
+        name: resolve_snippet(name, search_dirs, workspace_snippets_dir, builtin_snippets_dir)
+        for name in dict.fromkeys(include)
+    }
+
+    missing = [name for name in include if resolved_by_name[name] is None]
+    if missing and strict:
+        raise RuntimeError(
+            f"Not regenerated; the following snippets were not found: "
+            f"{', '.join(missing)}"
         )
-        if resolved is None:
-            missing.append(name)
-        else:
-            included.append(name)
-            body = resolved.content.strip()
-            directive = (
-                f'<!-- prompt-weave:line {resolved.source_line} "{resolved.source_label}" -->'
-            )
-            if body:
-                bodies.append(f"{directive}\n{body}")
-            else:
-                bodies.append(directive)
-
-    generated_section = "\n\n".join(bodies)
-
-    # --- Assemble output --------------------------------------------------
-    parts: list[str] = []
-
-    if generated_section:
-        parts.append(generated_section)
-        parts.append("")          # blank line before separator
-
-    parts.append(SEPARATOR)
-
-    if user_section:
-        parts.append("")          # blank line after separator
-        parts.append(user_section)
-
-    output = "\n".join(parts) + "\n"
+    found = [(name, r) for name in include if (r := resolved_by_name[name]) is not None]
+    included = [name for name, _ in found]
+
+    # --- Build output -----------------------------------------------------
+    # Each piece is encoded straight into one buffer, which is what gets
+    # compared and written; no intermediate joined strings.
+    output = bytearray()
+    for _, resolved in found:
+        output += (_DIRECTIVE_FMT % (resolved.source_line, resolved.source_label)).encode("utf-8")
+        output += b"\n"
+        if resolved.content:
+            output += resolved.content.encode("utf-8")
+            output += b"\n"
+        output += b"\n"              # blank line after each snippet
+
+    # Most workspaces have nothing below the separator: one append finishes them.
+    output += _SEPARATOR_LINE
+    if existing.user_section:
+        output += b"\n"              # blank line after separator
+        output += existing.user_section
+        output += b"\n"
 
     # --- Write ------------------------------------------------------------
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_text(output, encoding="utf-8")
+    # An unchanged file is left alone so its mtime (and file watchers) stay quiet.
+    if output != existing.data:
+        try:
+            _write_bytes_atomic(output_path, output)
+        except FileNotFoundError:
+            # Only the first run in a workspace has to create .github/.
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_bytes_atomic(output_path, output)
 
     if missing:
         raise RuntimeError(
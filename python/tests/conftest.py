@@ -0,0 +1,21 @@
+"""Shared fixtures for the prompt_weave test suite."""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+import pytest
+
+from prompt_weave.core import clear_snippet_cache
+
+
+@pytest.fixture(autouse=True)
+def _isolated_snippet_cache() -> Iterator[None]:
+    """Give every test an empty in-process snippet cache.
+
+    The cache is the only module-level state in core, so clearing it keeps
+    tests independent of run order and safe to run in parallel workers.
+    """
+    clear_snippet_cache()
+    yield
+    clear_snippet_cache()
@@ -11,38 +11,79 @@ load_snippet
 - Priority: workspace dir overrides builtin; full three-tier hierarchy.
 - Missing snippet: returns None.
 - Edge inputs: empty search-dirs list, non-existent directory in the path,
-  snippet with no front-matter, snippet with an empty body.
+  snippet with no front-matter, snippet with an empty body, a ``---`` rule in
+  the body, a longer closing fence, an unterminated front-matter fence, CRLF
+  line endings, Unicode whitespace around the body, a large snippet, a
+  directory where a snippet file is expected (the error names the path).
+- Encoding: a body that is not valid UTF-8 raises UnicodeDecodeError from both
+  load_snippet and regenerate.
+- Import cost: plain front matter is stripped without importing PyYAML.
+
+resolve_snippet
+---------------
+- Public signature: text content, tier label and body start line; None when
+  the snippet is missing.
+
+snippet cache
+-------------
+- Unchanged files are parsed once; a changed size or mtime forces a reload;
+  clear_snippet_cache() drops everything.
+- A snippet added to a directory between runs is found on the next run.
 
 regenerate
 ----------
-- File lifecycle: output file created from scratch, .github/ dir auto-created,
-  file deleted when include is empty and no user content remains.
+- File lifecycle: output file created from scratch, .github/ dir auto-created
+  (and not re-created when present), file deleted when include is empty and no
+  user content remains.
 - Separator semantics: generated content above, user content below, separator
   embedded inside user content is preserved (only the first split counts).
 - User-content preservation: existing content without a separator is treated as
-  user-owned; content below the separator survives regeneration.
+  user-owned; content below the separator survives regeneration, with CRLF
+  line endings normalized to LF.
 - Empty-include paths: file without separator left untouched, separator-only
   file deleted, user content kept when separator is removed.
 - Snippet resolution: multiple snippets concatenated in order, workspace
-  snippets override builtins end-to-end, duplicate names are included twice.
+  snippets override builtins end-to-end, ``sub/name`` includes resolve into
+  subdirectories, duplicate names are included twice but resolved once, long
+  include lists keep their order.
 - Error handling: missing snippets raise RuntimeError after writing the file;
-  error message lists *all* missing names.
+  error message lists *all* missing names; strict mode raises before writing.
 - Return value: list of successfully included snippet names.
+- Provenance: line directives name the source tier and the body's start line,
+  including for layouts handled by the python-frontmatter fallback.
 - Idempotency: two consecutive runs produce identical output (with and without
-  user content).
+  user content); an unchanged file is not rewritten.
+- Atomic writes: no temp file is left next to the output, even when the
+  rename fails; a symlinked output updates its target; an existing file keeps
+  its mode and a new one gets the umask default.
 - Content integrity: Unicode round-trip, trailing whitespace stripped, no
   excessive blank lines introduced, whitespace-only snippet bodies handled.
 - State transitions: changing the snippet list between runs removes old content.
 - Boundary files: 0-byte existing file, file that is only the separator line.
+
+Tests that only read the built-in ``base``/``docker`` snippets share one
+session-scoped directory (``canonical_builtin``) instead of writing their own.
 """
 
 from __future__ import annotations
 
+import os
+import subprocess
+import sys
 from pathlib import Path
+from typing import Any
 
 import pytest
 
-from prompt_weave.core import SEPARATOR, load_snippet, regenerate
+from prompt_weave import core
+from prompt_weave.core import (
+    SEPARATOR,
+    ResolvedSnippet,
+    clear_snippet_cache,
+    load_snippet,
+    regenerate,
+    resolve_snippet,
+)
 
 
 # ── Helpers ────────────────────────────────────────────────────────────────
@@ -52,11 +93,29 @@ def write_snippet(directory: Path, name: str, body: str, meta: dict | None = Non
     if meta is None:
         meta = {"name": name, "description": f"{name} snippet", "tags": []}
     directory.mkdir(parents=True, exist_ok=True)
-    lines = ["---"]
-    for key, value in meta.items():
-        lines.append(f"{key}: {value!r}")
-    lines += ["---", "", body]
-    (directory / f"{name}.md").write_text("\n".join(lines), encoding="utf-8")
+    front_matter = "".join(f"{key}: {value!r}\n" for key, value in meta.items())
+    text = f"---\n{front_matter}---\n\n{body}"
+    (directory / f"{name}.md").write_bytes(text.encode("utf-8"))
+
+
+@pytest.fixture(scope="session")
+def canonical_builtin(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Built-in snippets dir with ``base`` and ``docker``, written once per session.
+
+    Tests only read from it; a test that needs other built-ins builds its own.
+    """
+    directory = tmp_path_factory.mktemp("builtin_shared")
+    write_snippet(directory, "base", "## Base")
+    write_snippet(directory, "docker", "## Docker")
+    return directory
+
+
+@pytest.fixture
+def workspace_github(tmp_path: Path) -> Path:
+    """A fresh workspace whose ``.github`` directory already exists."""
+    workspace = tmp_path / "workspace"
+    (workspace / ".github").mkdir(parents=True)
+    return workspace
 
 
 # ── load_snippet ───────────────────────────────────────────────────────────
@@ -85,13 +144,60 @@ class TestLoadSnippet:
         result = load_snippet("nonexistent", [builtin])
         assert result is None
 
-    def test_front_matter_stripped(self, tmp_path: Path) -> None:
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Rules\n\nBe concise.")
-        result = load_snippet("base", [builtin])
-        assert result is not None
-        assert "---" not in result
-        assert "## Rules" in result
+    @pytest.mark.parametrize(
+        ("raw", "expected"),
+        [
+            pytest.param(
+                b"---\nname: base\n---\n\n## Rules\n\nBe concise.",
+                "## Rules\n\nBe concise.",
+                id="front-matter-stripped",
+            ),
+            pytest.param(
+                b"Just markdown\n\nNo front matter.",
+                "Just markdown\n\nNo front matter.",
+                id="no-front-matter",
+            ),
+            pytest.param(b"---\nname: empty\n---\n", "", id="empty-body"),
+            pytest.param(b"---\nname: a\n---", "", id="closing-fence-at-eof"),
+            # Only the leading fences are front matter; a later ``---`` is body text.
+            pytest.param(
+                b"---\nname: rules\n---\n\nAbove\n\n---\n\nBelow",
+                "Above\n\n---\n\nBelow",
+                id="horizontal-rule-in-body",
+            ),
+            # A longer closing fence still closes; a later ``---`` is body text.
+            pytest.param(
+                b"---\nname: a\n----\nbody\n---\nmore\n",
+                "body\n---\nmore",
+                id="longer-closing-fence",
+            ),
+            # Stripped as text, so Unicode whitespace such as NBSP goes too.
+            pytest.param(
+                "---\nname: a\n---\n\u00a0Body\u00a0\n".encode("utf-8"),
+                "Body",
+                id="unicode-whitespace",
+            ),
+            # An opening fence with no closing fence is not front matter.
+            pytest.param(
+                b"---\nname: open\nNo closing fence.\n",
+                "---\nname: open\nNo closing fence.",
+                id="unterminated-fence",
+            ),
+            # CRLF is read as LF, as a text-mode read would.
+            pytest.param(
+                b"---\r\nname: win\r\n---\r\n\r\nLine one\r\nLine two\r\n",
+                "Line one\nLine two",
+                id="crlf",
+            ),
+        ],
+    )
+    def test_file_layouts(self, tmp_path: Path, raw: bytes, expected: str) -> None:
+        """Each on-disk layout loads as its stripped body."""
+        snippets = tmp_path / "snippets"
+        snippets.mkdir()
+        (snippets / "snippet.md").write_bytes(raw)
+
+        assert load_snippet("snippet", [snippets]) == expected
 
     def test_empty_search_dirs_returns_none(self, tmp_path: Path) -> None:
         """No directories to search — should return None, not crash."""
@@ -107,25 +213,20 @@ class TestLoadSnippet:
         result = load_snippet("base", [ghost_dir, builtin])
         assert result == "Found"
 
-    def test_snippet_without_front_matter(self, tmp_path: Path) -> None:
-        """A plain Markdown file with no YAML front matter is loaded as-is."""
-        snippets = tmp_path / "snippets"
-        snippets.mkdir()
-        (snippets / "plain.md").write_text("Just markdown\n\nNo front matter.", encoding="utf-8")
-
-        result = load_snippet("plain", [snippets])
-        assert result is not None
-        assert "Just markdown" in result
-
-    def test_snippet_with_empty_body(self, tmp_path: Path) -> None:
-        """A snippet file with front matter but no body returns an empty string."""
+    def test_plain_front_matter_does_not_import_yaml(self, tmp_path: Path) -> None:
+        """The common ``---`` fence layout is stripped without loading python-frontmatter."""
         snippets = tmp_path / "snippets"
-        snippets.mkdir()
-        (snippets / "empty.md").write_text("---\nname: empty\n---\n", encoding="utf-8")
-
-        result = load_snippet("empty", [snippets])
-        assert result is not None
-        assert result.strip() == ""
+        write_snippet(snippets, "base", "Base content")
+        script = (
+            "import sys\n"
+            "from pathlib import Path\n"
+            "from prompt_weave.core import load_snippet\n"
+            f"assert load_snippet('base', [Path({str(snippets)!r})]) == 'Base content'\n"
+            "assert 'frontmatter' not in sys.modules\n"
+            "assert 'yaml' not in sys.modules\n"
+        )
+        package_root = Path(core.__file__).parents[1]
+        subprocess.run([sys.executable, "-c", script], check=True, cwd=package_root)
 
     def test_three_tier_priority(self, tmp_path: Path) -> None:
         """With three search dirs, the first (workspace) wins over second (user) and third (builtin)."""
@@ -143,6 +244,120 @@ class TestLoadSnippet:
         # Only builtin
         assert load_snippet("base", [builtin_dir]) == "Builtin version"
 
+    def test_invalid_utf8_rejected(self, tmp_path: Path, canonical_builtin: Path) -> None:
+        """A body that is not UTF-8 fails the load instead of reaching the output."""
+        snippets = tmp_path / "workspace" / ".prompt-weave" / "snippets"
+        snippets.mkdir(parents=True)
+        (snippets / "bad.md").write_bytes(b"---\nname: bad\n---\n\nCaf\xe9\n")
+
+        with pytest.raises(UnicodeDecodeError):
+            load_snippet("bad", [snippets])
+        with pytest.raises(UnicodeDecodeError):
+            regenerate(tmp_path / "workspace", canonical_builtin, ["bad"])
+
+    def test_directory_named_like_snippet_error_names_path(self, tmp_path: Path) -> None:
+        snippets = tmp_path / "snippets"
+        (snippets / "odd.md").mkdir(parents=True)
+
+        with pytest.raises(OSError) as excinfo:
+            load_snippet("odd", [snippets])
+        assert str(snippets / "odd.md") in str(excinfo.value)
+
+    def test_large_snippet_read_in_full(self, tmp_path: Path) -> None:
+        snippets = tmp_path / "snippets"
+        body = "Long line of guidance.\n" * 65536
+        write_snippet(snippets, "big", body)
+
+        assert load_snippet("big", [snippets]) == body.strip()
+
+
+# ── resolve_snippet ────────────────────────────────────────────────────────
+
+class TestResolveSnippet:
+    def test_returns_text_and_provenance(self, tmp_path: Path) -> None:
+        workspace_snippets = tmp_path / "workspace" / ".prompt-weave" / "snippets"
+        builtin = tmp_path / "builtin"
+        write_snippet(builtin, "base", "## Base")
+
+        result = resolve_snippet(
+            "base",
+            search_dirs=[workspace_snippets, builtin],
+            workspace_snippets_dir=workspace_snippets,
+            builtin_snippets_dir=builtin,
+        )
+
+        assert result == ResolvedSnippet(
+            content="## Base", source_label="builtin:base.md", source_line=6
+        )
+
+    def test_missing_returns_none(self, tmp_path: Path) -> None:
+        builtin = tmp_path / "builtin"
+        builtin.mkdir()
+
+        result = resolve_snippet(
+            "ghost",
+            search_dirs=[builtin],
+            workspace_snippets_dir=tmp_path / "workspace",
+            builtin_snippets_dir=builtin,
+        )
+
+        assert result is None
+
+
+# ── snippet cache ──────────────────────────────────────────────────────────
+
+class TestSnippetCache:
+    def test_unchanged_file_parsed_once(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        snippets = tmp_path / "snippets"
+        write_snippet(snippets, "base", "Base content")
+        calls: list[bytes] = []
+        real_split = core._split_frontmatter
+
+        def counting_split(data: bytes) -> Any:
+            calls.append(data)
+            return real_split(data)
+
+        monkeypatch.setattr(core, "_split_frontmatter", counting_split)
+
+        assert load_snippet("base", [snippets]) == "Base content"
+        assert load_snippet("base", [snippets]) == "Base content"
+        assert len(calls) == 1
+
+    def test_modified_file_reloaded(self, tmp_path: Path) -> None:
+        snippets = tmp_path / "snippets"
+        write_snippet(snippets, "base", "Old")
+        assert load_snippet("base", [snippets]) == "Old"
+
+        write_snippet(snippets, "base", "Newer content")
+        assert load_snippet("base", [snippets]) == "Newer content"
+
+    def test_clear_forces_reload(self, tmp_path: Path) -> None:
+        snippets = tmp_path / "snippets"
+        write_snippet(snippets, "base", "Base content")
+        path = snippets / "base.md"
+        load_snippet("base", [snippets])
+        stat = path.stat()
+
+        # Same size and mtime: only clearing the cache can reveal the edit.
+        write_snippet(snippets, "base", "Edit content")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert load_snippet("base", [snippets]) == "Base content"
+
+        clear_snippet_cache()
+        assert load_snippet("base", [snippets]) == "Edit content"
+
+    def test_added_snippet_found_on_next_run(self, tmp_path: Path) -> None:
+        workspace = tmp_path / "workspace"
+        builtin = tmp_path / "builtin"
+        write_snippet(builtin, "base", "Base content")
+        regenerate(workspace, builtin, ["base"])
+
+        write_snippet(builtin, "extra", "Extra content")
+
+        assert regenerate(workspace, builtin, ["base", "extra"]) == ["base", "extra"]
+
 
 # ── regenerate ─────────────────────────────────────────────────────────────
 
@@ -168,16 +383,18 @@ class TestRegenerate:
         regenerate(workspace, builtin, ["base"])
 
         text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
-        generated_part, _sep, _rest = text.partition(SEPARATOR)
-        assert "Generated content" in generated_part
+        generated, separator, user = text.partition(SEPARATOR)
+        assert separator
+        assert "Generated content" in generated
+        assert "Generated content" not in user
 
-    def test_preserves_user_content_below_separator(self, tmp_path: Path) -> None:
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+    def test_preserves_user_content_below_separator(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text(
             f"Old generated\n\n{SEPARATOR}\n\nUser notes here.\n",
             encoding="utf-8",
@@ -190,127 +407,192 @@ class TestRegenerate:
         assert "User notes here." in text
         assert "Old generated" not in text
 
-    def test_user_content_appears_after_separator(self, tmp_path: Path) -> None:
-        workspace = tmp_path / "workspace"
+    def test_user_content_appears_after_separator(
+        self, tmp_path: Path, workspace_github: Path
+    ) -> None:
+        workspace = workspace_github
         builtin = tmp_path / "builtin"
         write_snippet(builtin, "base", "Generated")
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text(f"Old\n\n{SEPARATOR}\n\nMy notes\n", encoding="utf-8")
 
         regenerate(workspace, builtin, ["base"])
 
-        text = output_path.read_text(encoding="utf-8")
-        assert text.index(SEPARATOR) < text.index("My notes")
-        assert text.index(SEPARATOR) > text.index("Generated")
-
-    def test_empty_include_does_not_create_file(self, tmp_path: Path) -> None:
+        generated, separator, user = output_path.read_text(encoding="utf-8").partition(SEPARATOR)
+        assert separator
+        assert "Generated" in generated
+        assert "My notes" in user
+
+    @pytest.mark.parametrize(
+        ("existing", "expected"),
+        [
+            pytest.param(None, None, id="no-file-not-created"),
+            pytest.param(
+                f"## Generated\n\n{SEPARATOR}\n\nMy custom notes.\n",
+                "My custom notes.\n",
+                id="separator-removed-user-content-kept",
+            ),
+            pytest.param(f"## Generated\n\n{SEPARATOR}\n", None, id="no-user-content-file-deleted"),
+            pytest.param(
+                "My hand-written instructions.\n",
+                "My hand-written instructions.\n",
+                id="no-separator-untouched",
+            ),
+            pytest.param("", "", id="empty-file-untouched"),
+        ],
+    )
+    def test_empty_include(
+        self, tmp_path: Path, existing: str | None, expected: str | None
+    ) -> None:
+        """An empty include list strips the generated section and nothing else.
+
+        *existing*/*expected* are the file contents before/after; None means absent.
+        """
         workspace = tmp_path / "workspace"
         builtin = tmp_path / "builtin"
         builtin.mkdir()
+        output_path = workspace / ".github" / "copilot-instructions.md"
+        if existing is not None:
+            output_path.parent.mkdir(parents=True)
+            output_path.write_text(existing, encoding="utf-8")
+
+        assert regenerate(workspace, builtin, []) == []
+
+        if expected is None:
+            assert not output_path.exists()
+        else:
+            assert output_path.read_text(encoding="utf-8") == expected
+
+    def test_crlf_user_section_normalized(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        """A user section saved with CRLF is written with LF, like the generated half."""
+        output_path = workspace_github / ".github" / "copilot-instructions.md"
+        output_path.write_bytes(
+            f"Old\r\n\r\n{SEPARATOR}\r\n\r\nuser line\r\nline2\r\n".encode("utf-8")
+        )
 
-        regenerate(workspace, builtin, [])
+        regenerate(workspace_github, canonical_builtin, ["base"])
 
-        output = workspace / ".github" / "copilot-instructions.md"
-        assert not output.exists()
+        data = output_path.read_bytes()
+        assert b"\r" not in data
+        assert data.endswith(f"{SEPARATOR}\n\nuser line\nline2\n".encode("utf-8"))
 
-    def test_empty_include_removes_separator_keeps_user_content(self, tmp_path: Path) -> None:
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        builtin.mkdir()
+    def test_nonempty_include_preserves_existing_file_as_user_content(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
-        output_path.write_text(
-            f"## Generated\n\n{SEPARATOR}\n\nMy custom notes.\n",
-            encoding="utf-8",
-        )
+        output_path.write_text("My old instructions.\n", encoding="utf-8")
 
-        regenerate(workspace, builtin, [])
+        regenerate(workspace, builtin, ["base"])
 
-        text = output_path.read_text(encoding="utf-8")
-        assert "My custom notes." in text
-        assert SEPARATOR not in text
+        generated, separator, user = output_path.read_text(encoding="utf-8").partition(SEPARATOR)
+        assert separator
+        assert "## Base" in generated
+        assert "My old instructions." in user
 
-    def test_empty_include_deletes_file_when_no_user_content(self, tmp_path: Path) -> None:
+    def test_multiple_snippets_concatenated_in_order(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        builtin.mkdir()
+        builtin = canonical_builtin
 
-        output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
-        output_path.write_text(
-            f"## Generated\n\n{SEPARATOR}\n",
-            encoding="utf-8",
-        )
+        regenerate(workspace, builtin, ["base", "docker"])
 
-        regenerate(workspace, builtin, [])
+        text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
+        assert text.index("## Base") < text.index("## Docker")
 
-        assert not output_path.exists()
+    def test_includes_line_directive_comments_per_snippet(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
+        """Each included snippet is preceded by a #line-style provenance comment."""
+        workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
+
+        regenerate(workspace, builtin, ["base", "docker"])
 
-    def test_empty_include_leaves_file_without_separator_untouched(self, tmp_path: Path) -> None:
+        text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
+        assert '<!-- prompt-weave:line ' in text
+        assert '"builtin:base.md" -->' in text
+        assert '"builtin:docker.md" -->' in text
+        assert text.index('"builtin:base.md" -->') < text.index("## Base")
+        assert text.index('"builtin:docker.md" -->') < text.index("## Docker")
+
+    def test_many_snippets_keep_include_order(self, tmp_path: Path) -> None:
+        """A long include list with a repeated name comes out in include order."""
         workspace = tmp_path / "workspace"
         builtin = tmp_path / "builtin"
-        builtin.mkdir()
-
-        output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
-        original = "My hand-written instructions.\n"
-        output_path.write_text(original, encoding="utf-8")
+        names = [f"s{i}" for i in range(12)]
+        for name in names:
+            write_snippet(builtin, name, f"## {name.upper()}")
 
-        regenerate(workspace, builtin, [])
+        include = list(reversed(names)) + ["s5"]
+        result = regenerate(workspace, builtin, include)
 
-        assert output_path.read_text(encoding="utf-8") == original
+        assert result == include
+        text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
+        positions = [text.index(f"## {name.upper()}\n") for name in reversed(names)]
+        assert positions == sorted(positions)
+        assert text.count("## S5\n") == 2
 
-    def test_nonempty_include_preserves_existing_file_as_user_content(self, tmp_path: Path) -> None:
+    def test_snippet_in_subdirectory_resolved(self, tmp_path: Path) -> None:
+        """A ``sub/name`` include resolves to ``sub/name.md`` in the search directory."""
         workspace = tmp_path / "workspace"
         builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        write_snippet(builtin / "lang", "python", "## Python")
 
-        output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
-        output_path.write_text("My old instructions.\n", encoding="utf-8")
+        assert regenerate(workspace, builtin, ["lang/python"]) == ["lang/python"]
+
+        text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
+        assert '<!-- prompt-weave:line 6 "builtin:python.md" -->\n## Python\n' in text
+
+    def test_line_directive_labels_workspace_tier(self, tmp_path: Path) -> None:
+        """A snippet resolved from the workspace tier is labelled as such."""
+        workspace = tmp_path / "workspace"
+        builtin = tmp_path / "builtin"
+        write_snippet(builtin, "base", "Builtin base rules")
+        write_snippet(workspace / ".prompt-weave" / "snippets", "base", "Workspace rules")
 
         regenerate(workspace, builtin, ["base"])
 
-        text = output_path.read_text(encoding="utf-8")
-        assert "## Base" in text
-        assert SEPARATOR in text
-        assert "My old instructions." in text
-        assert text.index(SEPARATOR) < text.index("My old instructions.")
+        text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
+        assert '"workspace:base.md" -->' in text
+        assert '"builtin:base.md" -->' not in text
 
-    def test_multiple_snippets_concatenated_in_order(self, tmp_path: Path) -> None:
+    def test_line_directive_points_at_body_start(self, tmp_path: Path) -> None:
+        """The directive line number is the first line after the closing front-matter fence."""
         workspace = tmp_path / "workspace"
         builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
-        write_snippet(builtin, "docker", "## Docker")
+        write_snippet(builtin, "base", "## Base")  # 3 meta lines → closing fence on line 5
+        builtin.joinpath("plain.md").write_text("## Plain\n", encoding="utf-8")
 
-        regenerate(workspace, builtin, ["base", "docker"])
+        regenerate(workspace, builtin, ["base", "plain"])
 
         text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
-        assert text.index("## Base") < text.index("## Docker")
+        assert '<!-- prompt-weave:line 6 "builtin:base.md" -->' in text
+        assert '<!-- prompt-weave:line 1 "builtin:plain.md" -->' in text
 
-    def test_includes_line_directive_comments_per_snippet(self, tmp_path: Path) -> None:
-        """Each included snippet is preceded by a #line-style provenance comment."""
+    def test_line_directive_for_fallback_layout(self, tmp_path: Path) -> None:
+        """Layouts parsed by python-frontmatter still point past the closing fence."""
         workspace = tmp_path / "workspace"
         builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
-        write_snippet(builtin, "docker", "## Docker")
+        builtin.mkdir()
+        builtin.joinpath("indented.md").write_text(" ---\nname: a\n---\nbody\n", encoding="utf-8")
 
-        regenerate(workspace, builtin, ["base", "docker"])
+        regenerate(workspace, builtin, ["indented"])
 
         text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
-        assert '<!-- prompt-weave:line ' in text
-        assert '"builtin:base.md" -->' in text
-        assert '"builtin:docker.md" -->' in text
-        assert text.index('"builtin:base.md" -->') < text.index("## Base")
-        assert text.index('"builtin:docker.md" -->') < text.index("## Docker")
+        assert '<!-- prompt-weave:line 4 "builtin:indented.md" -->\nbody\n' in text
 
-    def test_missing_snippet_raises_after_writing(self, tmp_path: Path) -> None:
+    def test_missing_snippet_raises_after_writing(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
 
         with pytest.raises(RuntimeError, match="ghost"):
             regenerate(workspace, builtin, ["base", "ghost"])
@@ -319,20 +601,54 @@ class TestRegenerate:
         text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
         assert "## Base" in text
 
-    def test_github_dir_created_automatically(self, tmp_path: Path) -> None:
+    def test_strict_missing_snippet_raises_before_writing(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
+
+        with pytest.raises(RuntimeError, match="ghost"):
+            regenerate(workspace, builtin, ["base", "ghost"], strict=True)
+
+        assert not (workspace / ".github" / "copilot-instructions.md").exists()
+
+    def test_strict_missing_snippet_leaves_existing_file(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        workspace = workspace_github
+        builtin = canonical_builtin
+        output_path = workspace / ".github" / "copilot-instructions.md"
+        original = f"Old generated\n\n{SEPARATOR}\n\nUser notes\n"
+        output_path.write_text(original, encoding="utf-8")
+
+        with pytest.raises(RuntimeError, match="ghost"):
+            regenerate(workspace, builtin, ["base", "ghost"], strict=True)
+
+        assert output_path.read_text(encoding="utf-8") == original
+
+    def test_strict_all_found_writes(self, tmp_path: Path, canonical_builtin: Path) -> None:
+        workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
+
+        assert regenerate(workspace, builtin, ["base"], strict=True) == ["base"]
+        assert "## Base" in (workspace / ".github" / "copilot-instructions.md").read_text(
+            encoding="utf-8"
+        )
+
+    def test_github_dir_created_automatically(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
+        workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
 
         assert not (workspace / ".github").exists()
         regenerate(workspace, builtin, ["base"])
         assert (workspace / ".github" / "copilot-instructions.md").exists()
 
-    def test_idempotent_regeneration(self, tmp_path: Path) -> None:
+    def test_idempotent_regeneration(self, tmp_path: Path, canonical_builtin: Path) -> None:
         """Running regenerate twice should produce the same output."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
 
         regenerate(workspace, builtin, ["base"])
         first = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
@@ -342,14 +658,105 @@ class TestRegenerate:
 
         assert first == second
 
+    def test_existing_github_dir_not_recreated(
+        self, workspace_github: Path, canonical_builtin: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        def fail_mkdir(*args: Any, **kwargs: Any) -> None:
+            raise AssertionError("mkdir called for an existing directory")
+
+        monkeypatch.setattr(Path, "mkdir", fail_mkdir)
+
+        assert regenerate(workspace_github, canonical_builtin, ["base"]) == ["base"]
+
+    def test_unchanged_output_not_rewritten(self, tmp_path: Path, canonical_builtin: Path) -> None:
+        """A regeneration that produces identical output leaves the file untouched."""
+        workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
+        output_path = workspace / ".github" / "copilot-instructions.md"
+
+        regenerate(workspace, builtin, ["base"])
+        inode = output_path.stat().st_ino
+
+        regenerate(workspace, builtin, ["base"])
+        assert output_path.stat().st_ino == inode
+
+    def test_write_leaves_no_temp_file(self, tmp_path: Path, canonical_builtin: Path) -> None:
+        """The atomic write's temp file is renamed into place, not left behind."""
+        workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
+
+        regenerate(workspace, builtin, ["base"])
+
+        assert sorted(p.name for p in (workspace / ".github").iterdir()) == [
+            "copilot-instructions.md"
+        ]
+
+    def test_failed_write_removes_temp_file(
+        self, workspace_github: Path, canonical_builtin: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """If the final rename fails, the old file stays and no temp file is left."""
+        output_path = workspace_github / ".github" / "copilot-instructions.md"
+        output_path.write_text("My notes\n", encoding="utf-8")
+
+        def failing_replace(src: Any, dst: Any) -> None:
+            raise OSError("disk full")
+
+        monkeypatch.setattr(os, "replace", failing_replace)
+
+        with pytest.raises(OSError, match="disk full"):
+            regenerate(workspace_github, canonical_builtin, ["base"])
+        assert [p.name for p in output_path.parent.iterdir()] == ["copilot-instructions.md"]
+        assert output_path.read_text(encoding="utf-8") == "My notes\n"
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="symlinks need privileges on Windows")
+    def test_symlinked_output_updates_target(
+        self, tmp_path: Path, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        """A symlinked output file stays a link; its target gets the new content."""
+        target = tmp_path / "shared-instructions.md"
+        target.write_text("My notes\n", encoding="utf-8")
+        output_path = workspace_github / ".github" / "copilot-instructions.md"
+        output_path.symlink_to(target)
+
+        regenerate(workspace_github, canonical_builtin, ["base"])
+
+        assert output_path.is_symlink()
+        text = target.read_text(encoding="utf-8")
+        assert "## Base" in text
+        assert text.endswith("My notes\n")
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="POSIX permission bits")
+    def test_rewrite_keeps_file_mode(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
+        output_path = workspace_github / ".github" / "copilot-instructions.md"
+        output_path.write_text("My notes\n", encoding="utf-8")
+        output_path.chmod(0o640)
+
+        regenerate(workspace_github, canonical_builtin, ["base"])
+
+        assert output_path.stat().st_mode & 0o777 == 0o640
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="POSIX permission bits")
+    def test_new_file_mode_follows_umask(self, tmp_path: Path, canonical_builtin: Path) -> None:
+        workspace = tmp_path / "workspace"
+        previous = os.umask(0o027)
+        try:
+            regenerate(workspace, canonical_builtin, ["base"])
+        finally:
+            os.umask(previous)
+
+        output_path = workspace / ".github" / "copilot-instructions.md"
+        assert output_path.stat().st_mode & 0o777 == 0o640
+
     # ── Additional corner-case tests ──────────────────────────────────────
 
-    def test_returns_list_of_included_snippet_names(self, tmp_path: Path) -> None:
+    def test_returns_list_of_included_snippet_names(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         """regenerate() returns the names of snippets that were successfully included."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
-        write_snippet(builtin, "docker", "## Docker")
+        builtin = canonical_builtin
 
         result = regenerate(workspace, builtin, ["base", "docker"])
         assert result == ["base", "docker"]
@@ -363,22 +770,22 @@ class TestRegenerate:
         with pytest.raises(RuntimeError, match="ghost1"):
             regenerate(workspace, builtin, ["ghost1", "ghost2"])
 
-    def test_multiple_missing_snippets_all_listed_in_error(self, tmp_path: Path) -> None:
+    def test_multiple_missing_snippets_all_listed_in_error(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         """Error message lists every missing snippet, not just the first."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
 
         with pytest.raises(RuntimeError, match="alpha") as exc_info:
             regenerate(workspace, builtin, ["base", "alpha", "beta"])
         assert "alpha" in str(exc_info.value)
         assert "beta" in str(exc_info.value)
 
-    def test_duplicate_snippet_in_include(self, tmp_path: Path) -> None:
+    def test_duplicate_snippet_in_include(self, tmp_path: Path, canonical_builtin: Path) -> None:
         """Including the same snippet twice results in its content appearing twice."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
 
         result = regenerate(workspace, builtin, ["base", "base"])
 
@@ -387,14 +794,33 @@ class TestRegenerate:
         assert text.count("## Base") == 2
         assert result == ["base", "base"]
 
-    def test_unicode_content_preserved(self, tmp_path: Path) -> None:
-        """Unicode in snippets and user content is preserved round-trip."""
+    def test_duplicate_snippet_resolved_once(
+        self, tmp_path: Path, canonical_builtin: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """A name listed twice is resolved only once per regeneration, hit or miss."""
         workspace = tmp_path / "workspace"
+        builtin = canonical_builtin
+        calls: list[str] = []
+        real_resolve = core.resolve_snippet
+
+        def counting_resolve(name: str, *args: Any) -> Any:
+            calls.append(name)
+            return real_resolve(name, *args)
+
+        monkeypatch.setattr(core, "resolve_snippet", counting_resolve)
+
+        with pytest.raises(RuntimeError, match="ghost, ghost"):
+            regenerate(workspace, builtin, ["base", "ghost", "base", "ghost"])
+
+        assert calls == ["base", "ghost"]
+
+    def test_unicode_content_preserved(self, tmp_path: Path, workspace_github: Path) -> None:
+        """Unicode in snippets and user content is preserved round-trip."""
+        workspace = workspace_github
         builtin = tmp_path / "builtin"
         write_snippet(builtin, "intl", "Héllo wörld — «quotes» 中文 🚀")
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text(
             f"Old\n\n{SEPARATOR}\n\nUser notes: café ñ 日本語\n",
             encoding="utf-8",
@@ -406,14 +832,12 @@ class TestRegenerate:
         assert "Héllo wörld — «quotes» 中文 🚀" in text
         assert "café ñ 日本語" in text
 
-    def test_existing_empty_file(self, tmp_path: Path) -> None:
+    def test_existing_empty_file(self, workspace_github: Path, canonical_builtin: Path) -> None:
         """A 0-byte existing output file is handled gracefully (treated as no user content)."""
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text("", encoding="utf-8")
 
         regenerate(workspace, builtin, ["base"])
@@ -422,14 +846,14 @@ class TestRegenerate:
         assert "## Base" in text
         assert SEPARATOR in text
 
-    def test_separator_inside_user_content_not_split(self, tmp_path: Path) -> None:
+    def test_separator_inside_user_content_not_split(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
         """Only the first separator is used for splitting; a second one in user content is preserved."""
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         # User content itself contains the separator string
         output_path.write_text(
             f"Old generated\n\n{SEPARATOR}\n\nUser notes\n{SEPARATOR}\nMore user notes\n",
@@ -446,14 +870,14 @@ class TestRegenerate:
         parts = text.split(SEPARATOR)
         assert len(parts) >= 2  # At least the main separator + user's embedded one
 
-    def test_idempotent_with_user_content(self, tmp_path: Path) -> None:
+    def test_idempotent_with_user_content(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
         """Regenerating twice with user content produces identical output."""
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text(
             f"Old\n\n{SEPARATOR}\n\nMy custom notes\n",
             encoding="utf-8",
@@ -467,12 +891,10 @@ class TestRegenerate:
 
         assert first == second
 
-    def test_changing_snippet_list(self, tmp_path: Path) -> None:
+    def test_changing_snippet_list(self, tmp_path: Path, canonical_builtin: Path) -> None:
         """Switching from [base, docker] to [base] removes docker content."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
-        write_snippet(builtin, "docker", "## Docker")
+        builtin = canonical_builtin
 
         regenerate(workspace, builtin, ["base", "docker"])
         text1 = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
@@ -497,14 +919,14 @@ class TestRegenerate:
         assert "Custom workspace rules" in text
         assert "Builtin base rules" not in text
 
-    def test_file_with_only_separator(self, tmp_path: Path) -> None:
+    def test_file_with_only_separator(
+        self, workspace_github: Path, canonical_builtin: Path
+    ) -> None:
         """Existing file that is just the separator line — no user content to preserve."""
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        workspace = workspace_github
+        builtin = canonical_builtin
 
         output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
         output_path.write_text(f"{SEPARATOR}\n", encoding="utf-8")
 
         regenerate(workspace, builtin, ["base"])
@@ -527,26 +949,12 @@ class TestRegenerate:
         text = (workspace / ".github" / "copilot-instructions.md").read_text(encoding="utf-8")
         assert SEPARATOR in text
 
-    def test_empty_include_with_empty_existing_file(self, tmp_path: Path) -> None:
-        """Empty include + empty existing file → file unchanged (no separator present)."""
-        workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        builtin.mkdir()
-
-        output_path = workspace / ".github" / "copilot-instructions.md"
-        output_path.parent.mkdir(parents=True)
-        output_path.write_text("", encoding="utf-8")
-
-        regenerate(workspace, builtin, [])
-
-        # File has no separator, so it's left untouched
-        assert output_path.read_text(encoding="utf-8") == ""
-
-    def test_single_snippet_no_extra_blank_lines(self, tmp_path: Path) -> None:
+    def test_single_snippet_no_extra_blank_lines(
+        self, tmp_path: Path, canonical_builtin: Path
+    ) -> None:
         """With one snippet and no user content, output has clean formatting."""
         workspace = tmp_path / "workspace"
-        builtin = tmp_path / "builtin"
-        write_snippet(builtin, "base", "## Base")
+        builtin = canonical_builtin
 
         regenerate(workspace, builtin, ["base"])
 